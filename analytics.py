@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+import database as db
+from config import ANALYTICS_BATCH_SIZE, ANALYTICS_MAX_BUFFER, ANALYTICS_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# --- Типы событий ---
+SEARCH_STARTED = "search_started"
+SEARCH_CANCELLED = "search_cancelled"
+CHAT_CREATED = "chat_created"
+CHAT_ENDED = "chat_ended"
+EXCHANGE_ACCEPTED = "exchange_accepted"
+MEDIA_SENT = "media_sent"
+WARNING_ISSUED = "warning_issued"
+
+# События копятся в памяти и пишутся в таблицу events пачками через COPY.
+_buffer = []
+_flush_lock = asyncio.Lock()
+_pending_tasks = set()
+# После ошибки записи track() не запускает сброс до этого момента (time.monotonic);
+# повторы в это время делает только flush_job.
+_retry_after = 0.0
+
+
+def _trim_buffer():
+    """При переполнении отбрасывает самые старые события."""
+    if len(_buffer) > ANALYTICS_MAX_BUFFER:
+        dropped = len(_buffer) - ANALYTICS_MAX_BUFFER
+        del _buffer[:dropped]
+        logger.warning(f"Буфер аналитики переполнен, отброшено старых событий: {dropped}")
+
+
+def track(event_type: str, user_id: int = None, partner_id: int = None, reason: str = None,
+          interests: list = None, duration_seconds: int = None):
+    """Добавляет событие в буфер. Не обращается к базе и не блокирует обработчик."""
+    _buffer.append((
+        datetime.now(timezone.utc), event_type, user_id, partner_id,
+        reason, interests, duration_seconds
+    ))
+    _trim_buffer()
+    if (len(_buffer) >= ANALYTICS_BATCH_SIZE and not _flush_lock.locked()
+            and time.monotonic() >= _retry_after):
+        task = asyncio.get_running_loop().create_task(flush())
+        _pending_tasks.add(task)
+        task.add_done_callback(_pending_tasks.discard)
+
+
+async def flush():
+    """Сбрасывает накопленные события в базу пачками по ANALYTICS_BATCH_SIZE."""
+    global _retry_after
+    async with _flush_lock:
+        while _buffer:
+            batch = _buffer[:ANALYTICS_BATCH_SIZE]
+            del _buffer[:len(batch)]
+            try:
+                await db.insert_events(batch)
+            except Exception as e:
+                logger.error(f"Не удалось записать {len(batch)} событий аналитики: {e}")
+                # Возвращаем пачку в начало буфера; следующий сброс — не раньше чем через
+                # ANALYTICS_FLUSH_SECONDS, чтобы не повторять COPY на каждое новое событие.
+                _buffer[:0] = batch
+                _trim_buffer()
+                _retry_after = time.monotonic() + ANALYTICS_FLUSH_SECONDS
+                return
+
+
+# --- Фоновые задачи для job_queue ---
+async def flush_job(context):
+    await flush()
+
+
+async def rollup_job(context):
+    """Сбрасывает буфер и пересчитывает дневные агрегаты."""
+    await flush()
+    try:
+        await db.rollup_daily_stats()
+    except Exception as e:
+        logger.error(f"Ошибка при пересчёте дневной статистики: {e}")
@@ -0,0 +1,75 @@
+import csv
+import io
+import re
+
+_SEPARATORS = re.compile(r"[\s,;]+")
+
+# Границы типов в базе: user_id — BIGINT, balance/amount — INTEGER
+MAX_USER_ID = 2**63 - 1
+MAX_AMOUNT = 2**31 - 1
+
+
+def parse_rows(lines, with_amount: bool):
+    """Разбирает строки файла по одной, не загружая список целиком.
+
+    Для каждой непустой строки (кроме комментариев с '#') возвращает
+    (номер строки, user_id, amount, ошибка). При ошибке user_id/amount = None.
+    Строка с лишними полями считается ошибкой, а не применяется частично.
+    """
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = [p for p in _SEPARATORS.split(line) if p]
+        expected = "ID и сумма" if with_amount else "ID"
+        if len(parts) != (2 if with_amount else 1):
+            yield line_no, None, None, f"ожидается ровно: {expected} (полей в строке: {len(parts)})"
+            continue
+        try:
+            user_id = int(parts[0])
+            amount = None
+            if with_amount:
+                amount = int(parts[1])
+        except ValueError:
+            yield line_no, None, None, f"ожидается: {expected}"
+            continue
+        if not 0 < user_id <= MAX_USER_ID:
+            yield line_no, None, None, "некорректный ID"
+            continue
+        if with_amount and not 0 < amount <= MAX_AMOUNT:
+            yield line_no, None, None, f"сумма должна быть от 1 до {MAX_AMOUNT}"
+            continue
+        yield line_no, user_id, amount, None
+
+
+def chunked(rows, size: int):
+    """Группирует поток строк в списки не длиннее size."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Report:
+    """Построчный отчёт о массовой операции в формате CSV."""
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(["line", "user_id", "amount", "result", "balance"])
+        self.ok = 0
+        self.failed = 0
+
+    def add(self, line_no: int, user_id, amount, result: str, balance=None, success: bool = True):
+        self._writer.writerow([line_no, user_id or "", amount or "", result, "" if balance is None else balance])
+        if success:
+            self.ok += 1
+        else:
+            self.failed += 1
+
+    def to_bytes(self) -> bytes:
+        return self._buffer.getvalue().encode("utf-8")
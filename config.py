@@ -18,6 +18,37 @@ COST_FOR_PHOTO = 50
 MAX_WARNINGS = 3
 CHAT_TIMER_SECONDS = 60
 
+# --- Подбор собеседника ---
+MATCH_CANDIDATES_LIMIT = 50  # Сколько ожидающих рассматриваем за один поиск
+RECENT_PARTNERS_LIMIT = 5  # Сколько последних собеседников не подбираем повторно
+RECENT_PARTNER_GRACE_SECONDS = 30  # После стольких секунд ожидания повтор разрешён
+REMATCH_INTERVAL_SECONDS = 10  # Как часто повторно подбираем пару ожидающим
+REMATCH_BATCH_SIZE = 20  # Сколько ожидающих проверяем за один проход
+
+# --- Аналитика ---
+ANALYTICS_BATCH_SIZE = 500  # Размер пачки для COPY в таблицу events
+ANALYTICS_MAX_BUFFER = 20000  # Больше событий в памяти не держим (старые отбрасываются)
+ANALYTICS_FLUSH_SECONDS = 30
+ANALYTICS_ROLLUP_SECONDS = 600
+ANALYTICS_REPORT_DAYS = 7
+
+# --- Защита от флуда ---
+# Класс пользователя: (сообщений в секунду, максимальная пачка подряд)
+FLOOD_LIMITS = {
+    "user": (1.0, 5),
+    "admin": (5.0, 30),
+}
+FLOOD_MEDIA_COST = 3  # Медиа "стоит" как несколько текстовых сообщений (альбом списывается один раз)
+FLOOD_CONTROL_LIMIT = (0.2, 3)  # Отдельный лимит для кнопок "Завершить чат"/"Начать новый чат"
+FLOOD_DROPS_PER_WARNING = 10  # Столько отброшенных сообщений подряд дают предупреждение
+FLOOD_DROP_WINDOW_SECONDS = 30  # Пауза, после которой счётчик флуда сбрасывается
+FLOOD_STATE_TTL_SECONDS = 300  # Через сколько секунд тишины состояние пользователя удаляется
+
+# --- Массовые админ-операции из файла ---
+BULK_MAX_FILE_SIZE = 5 * 1024 * 1024  # Максимальный размер загружаемого файла, байт
+BULK_CHUNK_SIZE = 1000  # Сколько строк применяем одним запросом
+NOTIFY_PER_SECOND = 20  # Лимит рассылки уведомлений (у Telegram ~30 сообщений/сек)
+
 ADMIN_IDS = set()
 
 AVAILABLE_INTERESTS = {
@@ -25,6 +25,40 @@ async def init_db():
                 partner_id BIGINT
             );
         """)
+        await connection.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS waiting_since TIMESTAMPTZ;")
+        await connection.execute(
+            "CREATE INDEX IF NOT EXISTS users_waiting_idx ON users (waiting_since) WHERE status = 'waiting';"
+        )
+        # --- Аналитика: журнал событий (только добавление) и дневные агрегаты ---
+        await connection.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                created_at TIMESTAMPTZ NOT NULL,
+                event_type TEXT NOT NULL,
+                user_id BIGINT,
+                partner_id BIGINT,
+                reason TEXT,
+                interests TEXT[],
+                duration_seconds INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS events_created_at_brin ON events USING BRIN (created_at);
+            CREATE TABLE IF NOT EXISTS daily_event_stats (
+                day DATE NOT NULL,
+                event_type TEXT NOT NULL,
+                reason TEXT NOT NULL DEFAULT '',
+                events INTEGER NOT NULL,
+                users INTEGER NOT NULL,
+                timed_events INTEGER NOT NULL DEFAULT 0,
+                avg_duration REAL,
+                PRIMARY KEY (day, event_type, reason)
+            );
+            CREATE TABLE IF NOT EXISTS daily_interest_stats (
+                day DATE NOT NULL,
+                interest TEXT NOT NULL,
+                chats_created INTEGER NOT NULL,
+                exchanges_accepted INTEGER NOT NULL,
+                PRIMARY KEY (day, interest)
+            );
+        """)
 
 async def close_db():
     if pool:
@@ -46,17 +80,49 @@ async def update_user_interests(user_id: int, interests: list):
     await pool.execute("UPDATE users SET interests = $1 WHERE user_id = $2", interests, user_id)
 
 async def update_user_status(user_id: int, status: str):
-    await pool.execute("UPDATE users SET status = $1, partner_id = NULL WHERE user_id = $2", status, user_id)
+    query = """
+        UPDATE users SET status = $1, partner_id = NULL,
+            waiting_since = CASE WHEN $1 = 'waiting' THEN now() ELSE NULL END
+        WHERE user_id = $2
+    """
+    await pool.execute(query, status, user_id)
 
 # --- Функции для чатов ---
-async def find_partner(user_id: int, interests: list):
-    query = "SELECT user_id FROM users WHERE status = 'waiting' AND user_id != $1 AND interests && $2::text[] LIMIT 1;"
-    return await pool.fetchval(query, user_id, interests)
+async def find_partner_candidates(user_id: int, interests: list, limit: int):
+    """Возвращает до `limit` ожидающих кандидатов (дольше всех ждущие — первыми).
+
+    Каждая запись: (user_id, interests, waited_seconds).
+    """
+    query = """
+        SELECT user_id, interests, EXTRACT(EPOCH FROM now() - waiting_since)::float AS waited
+        FROM users
+        WHERE status = 'waiting' AND user_id != $1 AND interests && $2::text[]
+        ORDER BY waiting_since ASC NULLS LAST
+        LIMIT $3;
+    """
+    return await pool.fetch(query, user_id, interests, limit)
 
 async def create_chat(user1_id: int, user2_id: int):
-    async with pool.acquire() as conn, conn.transaction():
-        await conn.execute("UPDATE users SET status = 'in_chat', partner_id = $1 WHERE user_id = $2", user2_id, user1_id)
-        await conn.execute("UPDATE users SET status = 'in_chat', partner_id = $1 WHERE user_id = $2", user1_id, user2_id)
+    """Соединяет двух ожидающих пользователей. Возвращает False, если кто-то из них уже не в поиске."""
+    query = """
+        UPDATE users SET status = 'in_chat', partner_id = $1, waiting_since = NULL
+        WHERE user_id = $2 AND status = 'waiting'
+    """
+    async with pool.acquire() as conn:
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            first = await conn.execute(query, user2_id, user1_id)
+            second = await conn.execute(query, user1_id, user2_id)
+        except Exception:
+            await transaction.rollback()
+            raise
+        if first != "UPDATE 1" or second != "UPDATE 1":
+            # Кого-то из пары уже соединили в другом месте (например, фоновым подбором)
+            await transaction.rollback()
+            return False
+        await transaction.commit()
+        return True
 
 async def end_chat(user_id: int):
     partner_id = await pool.fetchval("SELECT partner_id FROM users WHERE user_id = $1", user_id)
@@ -64,10 +130,38 @@ async def end_chat(user_id: int):
         await pool.execute("UPDATE users SET status = 'idle', partner_id = NULL WHERE user_id = ANY($1::bigint[])", [user_id, partner_id])
     return partner_id
 
+async def get_waiting_users(limit: int):
+    """Возвращает до `limit` ожидающих пользователей, дольше всех ждущие — первыми."""
+    query = """
+        SELECT user_id, interests FROM users
+        WHERE status = 'waiting'
+        ORDER BY waiting_since ASC NULLS LAST
+        LIMIT $1;
+    """
+    return await pool.fetch(query, limit)
+
 # --- Функции баланса и рефералов ---
 async def update_balance(user_id: int, amount_change: int):
     return await pool.fetchval("UPDATE users SET balance = balance + $1 WHERE user_id = $2 RETURNING balance", amount_change, user_id)
 
+async def bulk_update_balance(user_ids: list, amounts: list):
+    """Меняет баланс многим пользователям одним запросом. Возвращает {user_id: новый баланс}.
+
+    Повторяющиеся ID суммируются, так что каждое изменение учитывается.
+    """
+    query = """
+        UPDATE users AS u SET balance = u.balance + c.amount
+        FROM (
+            SELECT user_id, SUM(amount) AS amount
+            FROM UNNEST($1::bigint[], $2::int[]) AS t(user_id, amount)
+            GROUP BY user_id
+        ) AS c
+        WHERE u.user_id = c.user_id
+        RETURNING u.user_id, u.balance
+    """
+    rows = await pool.fetch(query, user_ids, amounts)
+    return {row['user_id']: row['balance'] for row in rows}
+
 async def add_referral(user_id: int, referrer_id: int, reward: int):
     async with pool.acquire() as conn, conn.transaction():
         await conn.execute("UPDATE users SET invited_by = $1 WHERE user_id = $2", referrer_id, user_id)
@@ -78,6 +172,14 @@ async def add_referral(user_id: int, referrer_id: int, reward: int):
 async def set_ban_status(user_id: int, is_banned: bool):
     await pool.execute("UPDATE users SET is_banned = $1, warnings = 0 WHERE user_id = $2", is_banned, user_id)
 
+async def bulk_set_ban_status(user_ids: list, is_banned: bool):
+    """Меняет статус бана сразу для многих пользователей. Возвращает множество найденных ID."""
+    rows = await pool.fetch(
+        "UPDATE users SET is_banned = $1, warnings = 0 WHERE user_id = ANY($2::bigint[]) RETURNING user_id",
+        is_banned, user_ids
+    )
+    return {row['user_id'] for row in rows}
+
 async def add_warning(user_id: int):
     return await pool.fetchval("UPDATE users SET warnings = warnings + 1 WHERE user_id = $1 RETURNING warnings", user_id)
 
@@ -89,6 +191,73 @@ async def get_all_active_users():
     """Возвращает список ID всех пользователей в активных чатах."""
     return await pool.fetch("SELECT user_id FROM users WHERE status = 'in_chat'")
 
+# --- Функции аналитики ---
+EVENT_COLUMNS = ['created_at', 'event_type', 'user_id', 'partner_id', 'reason', 'interests', 'duration_seconds']
+
+async def insert_events(records: list):
+    """Пишет пачку событий одной командой COPY."""
+    async with pool.acquire() as conn:
+        await conn.copy_records_to_table('events', records=records, columns=EVENT_COLUMNS)
+
+async def rollup_daily_stats():
+    """Пересчитывает дневные агрегаты за вчера и сегодня (вчера — ради поздно записанных событий).
+
+    Граница дня считается в базе (CURRENT_DATE), как и в created_at::date и
+    get_analytics_summary, чтобы все запросы использовали один часовой пояс.
+    """
+    async with pool.acquire() as conn, conn.transaction():
+        await conn.execute("""
+            INSERT INTO daily_event_stats (day, event_type, reason, events, users, timed_events, avg_duration)
+            SELECT created_at::date, event_type, COALESCE(reason, ''), COUNT(*),
+                   COUNT(DISTINCT user_id), COUNT(duration_seconds), AVG(duration_seconds)
+            FROM events
+            WHERE created_at >= CURRENT_DATE - 1
+            GROUP BY 1, 2, 3
+            ON CONFLICT (day, event_type, reason) DO UPDATE
+            SET events = EXCLUDED.events, users = EXCLUDED.users,
+                timed_events = EXCLUDED.timed_events, avg_duration = EXCLUDED.avg_duration;
+        """)
+        await conn.execute("""
+            INSERT INTO daily_interest_stats (day, interest, chats_created, exchanges_accepted)
+            SELECT created_at::date, interest,
+                   COUNT(*) FILTER (WHERE event_type = 'chat_created'),
+                   COUNT(*) FILTER (WHERE event_type = 'exchange_accepted')
+            FROM events, unnest(interests) AS interest
+            WHERE created_at >= CURRENT_DATE - 1
+              AND event_type IN ('chat_created', 'exchange_accepted')
+            GROUP BY 1, 2
+            ON CONFLICT (day, interest) DO UPDATE
+            SET chats_created = EXCLUDED.chats_created,
+                exchanges_accepted = EXCLUDED.exchanges_accepted;
+        """)
+
+async def get_analytics_summary(days: int):
+    """Читает готовые агрегаты за последние `days` дней для админ-панели."""
+    queries = [
+        pool.fetch("""
+            SELECT day,
+                   SUM(events) FILTER (WHERE event_type = 'search_started') AS searches,
+                   SUM(users) FILTER (WHERE event_type = 'search_started') AS searchers,
+                   SUM(events) FILTER (WHERE event_type = 'search_cancelled') AS cancelled,
+                   SUM(events) FILTER (WHERE event_type = 'chat_created') AS chats,
+                   SUM(timed_events * avg_duration) FILTER (WHERE event_type = 'chat_ended')
+                       / NULLIF(SUM(timed_events) FILTER (WHERE event_type = 'chat_ended'), 0) AS avg_duration,
+                   SUM(events) FILTER (WHERE event_type = 'exchange_accepted') AS exchanges,
+                   SUM(events) FILTER (WHERE event_type = 'warning_issued') AS warnings
+            FROM daily_event_stats
+            WHERE day > CURRENT_DATE - $1::int
+            GROUP BY day ORDER BY day DESC;
+        """, days),
+        pool.fetch("""
+            SELECT interest, SUM(chats_created) AS chats, SUM(exchanges_accepted) AS exchanges
+            FROM daily_interest_stats
+            WHERE day > CURRENT_DATE - $1::int
+            GROUP BY interest ORDER BY chats DESC;
+        """, days),
+    ]
+    daily, interests = await asyncio.gather(*queries)
+    return {"daily": daily, "interests": interests}
+
 async def get_admin_stats():
     """Собирает статистику для админ-панели."""
     queries = [
@@ -0,0 +1,78 @@
+import time
+
+# Результаты FloodLimiter.hit
+ALLOWED = "allowed"    # сообщение можно пропускать
+NOTIFY = "notify"      # первое отброшенное сообщение — стоит предупредить пользователя
+DROPPED = "dropped"    # сообщение молча отбрасывается
+ESCALATE = "escalate"  # флуд продолжается — пора выдавать предупреждение
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "drops", "last_drop", "last_quiet_drop")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.drops = 0
+        self.last_drop = 0.0
+        self.last_quiet_drop = float("-inf")
+
+
+class FloodLimiter:
+    """Token bucket на каждого пользователя.
+
+    `limits` — словарь {класс пользователя: (токенов в секунду, размер корзины)}.
+    Отброшенные сообщения считаются; каждые `drops_per_escalation` отброшенных
+    подряд (без паузы дольше `drop_window` секунд) дают ESCALATE. Отказы с
+    escalate=False (например, медиа) в этот счётчик не входят и дают только
+    NOTIFY/DROPPED. Состояние пользователя — пять чисел; неактивные записи
+    удаляет sweep().
+    """
+
+    def __init__(self, limits: dict, drops_per_escalation: int, drop_window: float, ttl: float):
+        self.limits = limits
+        self.drops_per_escalation = drops_per_escalation
+        self.drop_window = drop_window
+        self.ttl = ttl
+        self._buckets = {}
+
+    def hit(self, user_id: int, user_class: str, cost: float = 1.0, now: float = None,
+            escalate: bool = True) -> str:
+        now = time.monotonic() if now is None else now
+        rate, burst = self.limits.get(user_class, self.limits["user"])
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(burst, now)
+        else:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            return ALLOWED
+
+        if not escalate:
+            quiet_for = now - bucket.last_quiet_drop
+            bucket.last_quiet_drop = now
+            return NOTIFY if quiet_for > self.drop_window else DROPPED
+
+        if now - bucket.last_drop > self.drop_window:
+            bucket.drops = 0
+        bucket.drops += 1
+        bucket.last_drop = now
+        if bucket.drops == 1:
+            return NOTIFY
+        if bucket.drops % self.drops_per_escalation == 0:
+            return ESCALATE
+        return DROPPED
+
+    def sweep(self, now: float = None) -> int:
+        """Удаляет записи пользователей, молчавших дольше ttl. Возвращает число удалённых."""
+        now = time.monotonic() if now is None else now
+        expired = [uid for uid, bucket in self._buckets.items() if now - bucket.updated > self.ttl]
+        for uid in expired:
+            del self._buckets[uid]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._buckets)
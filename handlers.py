@@ -1,13 +1,25 @@
+import io
 import logging
 import re
+import time
+from collections import deque
+from datetime import datetime, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
+import analytics
+import bulk
 import database as db
+import flood
 import keyboards as kb
+import matching
 from config import (
     ADMIN_PASSWORD, ADMIN_IDS, REWARD_FOR_REFERRAL, COST_FOR_18PLUS,
-    COST_FOR_UNBAN, COST_FOR_PHOTO, CHAT_TIMER_SECONDS, MAX_WARNINGS
+    COST_FOR_UNBAN, COST_FOR_PHOTO, CHAT_TIMER_SECONDS, MAX_WARNINGS,
+    MATCH_CANDIDATES_LIMIT, RECENT_PARTNERS_LIMIT, RECENT_PARTNER_GRACE_SECONDS, REMATCH_BATCH_SIZE,
+    ANALYTICS_REPORT_DAYS, FLOOD_LIMITS, FLOOD_MEDIA_COST, FLOOD_DROPS_PER_WARNING,
+    FLOOD_DROP_WINDOW_SECONDS, FLOOD_STATE_TTL_SECONDS, FLOOD_CONTROL_LIMIT, BULK_MAX_FILE_SIZE, BULK_CHUNK_SIZE,
+    NOTIFY_PER_SECOND
 )
 
 logging.basicConfig(
@@ -15,6 +27,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+flood_limiter = flood.FloodLimiter(
+    FLOOD_LIMITS, FLOOD_DROPS_PER_WARNING, FLOOD_DROP_WINDOW_SECONDS, FLOOD_STATE_TTL_SECONDS
+)
+# Кнопки управления чатом идут через отдельную корзину, чтобы флуд текстом
+# не мешал завершить чат, но и сами кнопки нельзя было спамить без ограничений.
+FLOOD_CONTROL_TEXTS = {"🚫 Завершить чат", "🔍 Начать новый чат"}
+control_limiter = flood.FloodLimiter(
+    {"user": FLOOD_CONTROL_LIMIT}, FLOOD_DROPS_PER_WARNING, FLOOD_DROP_WINDOW_SECONDS, FLOOD_STATE_TTL_SECONDS
+)
+
 
 # --- Вспомогательные функции ---
 async def show_main_menu(user_id: int, context: ContextTypes.DEFAULT_TYPE, as_admin=False):
@@ -40,10 +62,11 @@ async def show_main_menu(user_id: int, context: ContextTypes.DEFAULT_TYPE, as_ad
     await context.bot.send_message(chat_id=user_id, text=text, reply_markup=keyboard)
 
 
-async def end_chat_session(user_id: int, context: ContextTypes.DEFAULT_TYPE, message_for_partner: str):
+async def end_chat_session(user_id: int, context: ContextTypes.DEFAULT_TYPE, message_for_partner: str, reason: str = "ended"):
     """Завершает чат, удаляет таймер и историю чата."""
     user = await db.get_or_create_user(user_id)
     partner_id = user['partner_id']
+    chat_info = None
     
     if partner_id:
         pair_key = tuple(sorted((user_id, partner_id)))
@@ -53,10 +76,16 @@ async def end_chat_session(user_id: int, context: ContextTypes.DEFAULT_TYPE, mes
             job.schedule_removal()
         context.bot_data.pop(f"history_{pair_key}", None)
         context.bot_data.pop(f"exchange_{pair_key}", None)
+        chat_info = context.bot_data.pop(f"chat_{pair_key}", None)
 
     actual_partner_id = await db.end_chat(user_id)
     
     if actual_partner_id:
+        analytics.track(
+            analytics.CHAT_ENDED, user_id, actual_partner_id, reason=reason,
+            interests=chat_info['interests'] if chat_info else None,
+            duration_seconds=int(time.time() - chat_info['started']) if chat_info else None
+        )
         if message_for_partner:
             await context.bot.send_message(actual_partner_id, message_for_partner, reply_markup=kb.remove_keyboard())
         is_partner_admin = actual_partner_id in ADMIN_IDS
@@ -67,6 +96,46 @@ async def end_chat_session(user_id: int, context: ContextTypes.DEFAULT_TYPE, mes
     await show_main_menu(user_id, context, as_admin=is_admin)
 
 
+async def issue_warning(user_id: int, partner_id, context: ContextTypes.DEFAULT_TYPE, reason: str, explanation: str):
+    """Выдаёт предупреждение и банит пользователя, если их набралось MAX_WARNINGS."""
+    new_warnings = await db.add_warning(user_id)
+    analytics.track(analytics.WARNING_ISSUED, user_id, partner_id, reason=reason)
+    await context.bot.send_message(user_id, f"⚠️ **Предупреждение {new_warnings}/{MAX_WARNINGS}**: {explanation}", parse_mode='Markdown')
+    if new_warnings >= MAX_WARNINGS:
+        await db.set_ban_status(user_id, True)
+        await context.bot.send_message(user_id, "❌ **Вы были заблокированы за многократные нарушения.**", reply_markup=kb.remove_keyboard(), parse_mode='Markdown')
+        if partner_id:
+            await end_chat_session(user_id, context, "⚠️ Ваш собеседник был забанен за нарушение правил. Чат завершён.", reason="banned")
+        else:
+            await show_main_menu(user_id, context)
+
+
+async def check_flood(update: Update, context: ContextTypes.DEFAULT_TYPE, cost: float = 1.0,
+                      escalate: bool = True, limiter: flood.FloodLimiter = flood_limiter) -> bool:
+    """Пропускает сообщение через антифлуд. Возвращает False, если его нужно отбросить.
+
+    С escalate=False отброшенные сообщения не ведут к предупреждениям.
+    """
+    user_id = update.effective_user.id
+    user_class = "admin" if user_id in ADMIN_IDS else "user"
+    result = limiter.hit(user_id, user_class, cost, escalate=escalate)
+    if result == flood.ALLOWED:
+        return True
+    if result == flood.NOTIFY:
+        await update.message.reply_text("⏳ Слишком много сообщений. Подождите немного — лишние сообщения не доставляются.")
+    elif result == flood.ESCALATE:
+        # Предупреждаем только за флуд в чате; вне чата лишние сообщения просто отбрасываются.
+        user = await db.get_or_create_user(user_id)
+        if not user['is_banned'] and user['status'] == 'in_chat':
+            await issue_warning(user_id, user['partner_id'], context, "flood", "Не отправляйте так много сообщений подряд.")
+    return False
+
+
+async def flood_sweep_job(context: ContextTypes.DEFAULT_TYPE):
+    flood_limiter.sweep()
+    control_limiter.sweep()
+
+
 # --- Обработчики команд ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -114,6 +183,48 @@ async def ask_for_exchange(context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(u2, "Время вышло! Хотите обменяться никами с собеседником?", reply_markup=kb.get_name_exchange_keyboard())
 
 
+# --- Подбор собеседника ---
+async def try_match(user_id: int, interests: list, context: ContextTypes.DEFAULT_TYPE, exclude=()) -> int:
+    """Ищет собеседника для ожидающего пользователя и создаёт чат. Возвращает ID собеседника или None."""
+    recent_partners = context.bot_data.setdefault("recent_partners", matching.RecentPartners(RECENT_PARTNERS_LIMIT))
+    candidates = await db.find_partner_candidates(user_id, interests, MATCH_CANDIDATES_LIMIT)
+    candidates = [c for c in candidates if c['user_id'] not in exclude]
+    partner_id = matching.pick_partner(user_id, interests, candidates, recent_partners, RECENT_PARTNER_GRACE_SECONDS)
+    if not partner_id or not await db.create_chat(user_id, partner_id):
+        return None
+    recent_partners.remember(user_id, partner_id)
+    partner_interests = next(c['interests'] for c in candidates if c['user_id'] == partner_id)
+    common_interests = [i for i in interests if i in partner_interests]
+    analytics.track(analytics.CHAT_CREATED, user_id, partner_id, interests=common_interests)
+    chat_message = f"🎉 Собеседник найден! У вас есть {CHAT_TIMER_SECONDS} секунд для общения, после чего бот предложит обменяться никами."
+    await context.bot.send_message(user_id, chat_message, reply_markup=kb.get_chat_keyboard())
+    await context.bot.send_message(partner_id, chat_message, reply_markup=kb.get_chat_keyboard())
+    pair_key = tuple(sorted((user_id, partner_id)))
+    context.bot_data[f"chat_{pair_key}"] = {'started': time.time(), 'interests': common_interests}
+    context.job_queue.run_once(
+        ask_for_exchange,
+        CHAT_TIMER_SECONDS,
+        data={'user1': user_id, 'user2': partner_id},
+        name=f"chat_timer_{pair_key[0]}_{pair_key[1]}"
+    )
+    return partner_id
+
+
+async def rematch_job(context: ContextTypes.DEFAULT_TYPE):
+    """Повторно подбирает пару дольше всех ждущим пользователям.
+
+    Без этого недавние собеседники, пропущенные на время RECENT_PARTNER_GRACE_SECONDS,
+    так и остались бы в поиске, если никто новый не начнёт искать.
+    """
+    matched = set()
+    for row in await db.get_waiting_users(REMATCH_BATCH_SIZE):
+        if row['user_id'] in matched:
+            continue
+        partner_id = await try_match(row['user_id'], row['interests'], context, exclude=matched)
+        if partner_id:
+            matched.update((row['user_id'], partner_id))
+
+
 # --- Обработчик кнопок (Callback) ---
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -125,6 +236,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = await db.get_or_create_user(user_id)
         if user['status'] == 'waiting':
             await db.update_user_status(user_id, 'idle')
+            waited = None
+            if user['waiting_since']:
+                waited = int((datetime.now(timezone.utc) - user['waiting_since']).total_seconds())
+            analytics.track(analytics.SEARCH_CANCELLED, user_id, interests=user['interests'], duration_seconds=waited)
             await query.message.edit_text("✅ Поиск отменён.")
             await show_main_menu(user_id, context, as_admin=(user_id in ADMIN_IDS))
         else:
@@ -202,6 +317,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if all(response is not None for response in exchange_data.values()):
             u1, u2 = pair_key
             if exchange_data[u1] == 'yes' and exchange_data[u2] == 'yes':
+                chat_info = context.bot_data.get(f"chat_{pair_key}")
+                analytics.track(analytics.EXCHANGE_ACCEPTED, u1, u2, interests=chat_info['interests'] if chat_info else None)
                 user1_info = await context.bot.get_chat(u1)
                 user2_info = await context.bot.get_chat(u2)
                 user1_name = f"@{user1_info.username}" if user1_info.username else user1_info.first_name
@@ -211,7 +328,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await context.bot.send_message(u1, "❌ Один из собеседников отказался. Обмен не состоялся.")
                 await context.bot.send_message(u2, "❌ Один из собеседников отказался. Обмен не состоялся.")
-            await end_chat_session(user_id, context, "")
+            await end_chat_session(user_id, context, "", reason="exchange")
         return
 
     if data == "admin_stats":
@@ -228,24 +345,43 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
+    if data == "admin_analytics":
+        summary = await db.get_analytics_summary(ANALYTICS_REPORT_DAYS)
+        lines = [f"📈 **Аналитика за {ANALYTICS_REPORT_DAYS} дн.**\n"]
+        for row in summary['daily']:
+            avg_duration = f"{row['avg_duration']:.0f} с" if row['avg_duration'] is not None else "—"
+            lines.append(
+                f"📅 {row['day']:%d.%m}: поисков {row['searches'] or 0} ({row['searchers'] or 0} чел.), отмен {row['cancelled'] or 0}, "
+                f"чатов {row['chats'] or 0} (ср. {avg_duration}), обменов {row['exchanges'] or 0}, "
+                f"предупреждений {row['warnings'] or 0}"
+            )
+        if summary['interests']:
+            lines.append("\n🎯 **Интересы (чаты / обмены):**")
+            for row in summary['interests']:
+                lines.append(f"{row['interest']}: {row['chats']} / {row['exchanges']}")
+        if len(lines) == 1:
+            lines.append("Данных пока нет.")
+        await query.message.edit_text("\n".join(lines), parse_mode='Markdown', reply_markup=kb.get_admin_keyboard())
+        return
+
     if data == "admin_ban":
         context.user_data['awaiting_ban_id'] = True
-        await query.message.edit_text("Введите ID пользователя для бана:")
+        await query.message.edit_text("Введите ID пользователя для бана или отправьте .txt/.csv файл со списком ID:")
         return
         
     if data == "admin_unban":
         context.user_data['awaiting_unban_id'] = True
-        await query.message.edit_text("Введите ID пользователя для разбана:")
+        await query.message.edit_text("Введите ID пользователя для разбана или отправьте .txt/.csv файл со списком ID:")
         return
 
     if data == "admin_add_currency":
         context.user_data['awaiting_add_currency'] = True
-        await query.message.edit_text("Введите ID и сумму через пробел (например, 12345 100):")
+        await query.message.edit_text("Введите ID и сумму через пробел (например, 12345 100) или отправьте .txt/.csv файл с такими строками:")
         return
 
     if data == "admin_remove_currency":
         context.user_data['awaiting_remove_currency'] = True
-        await query.message.edit_text("Введите ID и сумму для списания через пробел:")
+        await query.message.edit_text("Введите ID и сумму для списания через пробел или отправьте .txt/.csv файл с такими строками:")
         return
 
     if data == "admin_stop_all":
@@ -257,7 +393,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for uid in uids_in_chat:
             user = await db.get_or_create_user(uid)
             if user['status'] == 'in_chat':
-                await end_chat_session(uid, context, "Чат принудительно завершен администратором.")
+                await end_chat_session(uid, context, "Чат принудительно завершен администратором.", reason="admin")
         await query.message.edit_text(f"✅ Завершено чатов: {len(uids_in_chat) // 2}.", reply_markup=kb.get_admin_keyboard())
         return
 
@@ -296,21 +432,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
         await db.update_user_interests(user_id, selected_interests)
         await db.update_user_status(user_id, 'waiting')
+        analytics.track(analytics.SEARCH_STARTED, user_id, interests=selected_interests)
         
-        partner_id = await db.find_partner(user_id, selected_interests)
-        if partner_id:
+        if await try_match(user_id, selected_interests, context):
             await query.message.delete()
-            await db.create_chat(user_id, partner_id)
-            chat_message = f"🎉 Собеседник найден! У вас есть {CHAT_TIMER_SECONDS} секунд для общения, после чего бот предложит обменяться никами."
-            await context.bot.send_message(user_id, chat_message, reply_markup=kb.get_chat_keyboard())
-            await context.bot.send_message(partner_id, chat_message, reply_markup=kb.get_chat_keyboard())
-            pair_key = tuple(sorted((user_id, partner_id)))
-            context.job_queue.run_once(
-                ask_for_exchange,
-                CHAT_TIMER_SECONDS,
-                data={'user1': user_id, 'user2': partner_id},
-                name=f"chat_timer_{pair_key[0]}_{pair_key[1]}"
-            )
         else:
             await query.message.edit_text("⏳ Ищем собеседника... Вы можете отменить поиск в любой момент.", reply_markup=kb.get_cancel_search_keyboard())
 
@@ -322,6 +447,15 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text
 
+    awaiting_input = context.user_data.get("awaiting_admin_password") or (
+        user_id in ADMIN_IDS and any(context.user_data.get(key) for key in BULK_ACTIONS)
+    )
+    if text in FLOOD_CONTROL_TEXTS:
+        if not await check_flood(update, context, escalate=False, limiter=control_limiter):
+            return
+    elif not awaiting_input and not await check_flood(update, context):
+        return
+
     if user_id in ADMIN_IDS:
         if context.user_data.get('awaiting_ban_id'):
             try:
@@ -404,10 +538,10 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if user['status'] == 'in_chat':
         if text == "🚫 Завершить чат":
-            await end_chat_session(user_id, context, "Собеседник завершил чат.")
+            await end_chat_session(user_id, context, "Собеседник завершил чат.", reason="user_ended")
             return
         if text == "🔍 Начать новый чат":
-            await end_chat_session(user_id, context, "Собеседник решил начать новый поиск.")
+            await end_chat_session(user_id, context, "Собеседник решил начать новый поиск.", reason="new_search")
             await update.message.reply_text("Выберите интересы для нового поиска:", reply_markup=await kb.get_interests_keyboard())
             return
         
@@ -423,12 +557,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         forbidden_keywords = ['@', 'ник', 'никнейм', 'username', 'юзернейм']
         if any(keyword in text.lower() for keyword in forbidden_keywords):
-            new_warnings = await db.add_warning(user_id)
-            await context.bot.send_message(user_id, f"⚠️ **Предупреждение {new_warnings}/{MAX_WARNINGS}**: Нельзя разглашать личную информацию.", parse_mode='Markdown')
-            if new_warnings >= MAX_WARNINGS:
-                await db.set_ban_status(user_id, True)
-                await context.bot.send_message(user_id, "❌ **Вы были заблокированы за многократные нарушения.**", reply_markup=kb.remove_keyboard(), parse_mode='Markdown')
-                await end_chat_session(user_id, context, "⚠️ Ваш собеседник был забанен за нарушение правил. Чат завершён.")
+            await issue_warning(user_id, partner_id, context, "personal_info", "Нельзя разглашать личную информацию.")
             return
         
         await context.bot.send_message(partner_id, text)
@@ -451,6 +580,17 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def media_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
+    # Альбом приходит пачкой отдельных сообщений с общим media_group_id —
+    # списываем его один раз, остальные части альбома разделяют то же решение.
+    media_group_id = update.message.media_group_id
+    last_group = context.user_data.get('flood_media_group')
+    if media_group_id is not None and last_group and last_group[0] == media_group_id:
+        allowed = last_group[1]
+    else:
+        allowed = await check_flood(update, context, FLOOD_MEDIA_COST, escalate=False)
+        context.user_data['flood_media_group'] = (media_group_id, allowed)
+    if not allowed:
+        return
     user = await db.get_or_create_user(user_id)
     if user['is_banned']:
         return
@@ -460,8 +600,101 @@ async def media_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             caption = f"✅ Медиа отправлено. Списано {COST_FOR_PHOTO} монет. Ваш баланс: {new_balance}."
             if update.message.photo:
                 await context.bot.send_photo(user['partner_id'], update.message.photo[-1].file_id)
+                analytics.track(analytics.MEDIA_SENT, user_id, user['partner_id'], reason="photo")
             elif update.message.video:
                 await context.bot.send_video(user['partner_id'], update.message.video.file_id)
+                analytics.track(analytics.MEDIA_SENT, user_id, user['partner_id'], reason="video")
             await update.message.reply_text(caption)
         else:
             await update.message.reply_text(f"❌ Недостаточно монет для отправки медиа (нужно {COST_FOR_PHOTO}).")
+
+
+# --- Массовые админ-операции из файла ---
+# Состояние ожидания -> текст уведомления для затронутого пользователя
+BULK_ACTIONS = {
+    'awaiting_ban_id': "❌ Вы были заблокированы администратором.",
+    'awaiting_unban_id': "✅ Вы были разблокированы администратором.",
+    'awaiting_add_currency': "🎉 Администратор начислил вам {amount} монет.",
+    'awaiting_remove_currency': "💸 Администратор списал у вас {amount} монет.",
+}
+
+
+async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Применяет бан/разбан/начисление/списание к списку ID из загруженного файла."""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        return
+    action = next((key for key in BULK_ACTIONS if context.user_data.get(key)), None)
+    if not action:
+        return
+    context.user_data.pop(action)
+
+    document = update.message.document
+    if document.file_size and document.file_size > BULK_MAX_FILE_SIZE:
+        await update.message.reply_text(f"❌ Файл слишком большой (максимум {BULK_MAX_FILE_SIZE // 1024} КБ).")
+        await admin_command(update, context)
+        return
+
+    buffer = io.BytesIO()
+    tg_file = await document.get_file()
+    await tg_file.download_to_memory(buffer)
+    buffer.seek(0)
+    lines = io.TextIOWrapper(buffer, encoding='utf-8-sig', errors='replace')
+
+    with_amount = action in ('awaiting_add_currency', 'awaiting_remove_currency')
+    sign = -1 if action == 'awaiting_remove_currency' else 1
+    report = bulk.Report()
+    notify_queue = context.bot_data.setdefault("notify_queue", deque())
+    notified = set()
+
+    async def apply(rows):
+        if with_amount:
+            return await db.bulk_update_balance([row[1] for row in rows], [sign * row[2] for row in rows])
+        found = await db.bulk_set_ban_status([row[1] for row in rows], action == 'awaiting_ban_id')
+        return dict.fromkeys(found)
+
+    for chunk in bulk.chunked(bulk.parse_rows(lines, with_amount), BULK_CHUNK_SIZE):
+        valid = [row for row in chunk if row[3] is None]
+        failed_lines = set()
+        try:
+            results = await apply(valid)
+        except Exception as e:
+            # Одна строка (например, переполнение баланса) не должна валить всю пачку —
+            # применяем строки пачки по одной.
+            logger.error(f"Ошибка массовой операции {action}, применяем пачку построчно: {e}")
+            results = {}
+            for row in valid:
+                try:
+                    results.update(await apply([row]))
+                except Exception:
+                    failed_lines.add(row[0])
+
+        for line_no, target_id, amount, error in chunk:
+            if error:
+                report.add(line_no, None, None, error, success=False)
+            elif line_no in failed_lines:
+                report.add(line_no, target_id, amount, "ошибка базы данных", success=False)
+            elif target_id not in results:
+                report.add(line_no, target_id, amount, "пользователь не найден", success=False)
+            else:
+                report.add(line_no, target_id, amount, "ok", balance=results[target_id])
+                if with_amount or target_id not in notified:
+                    notified.add(target_id)
+                    notify_queue.append((target_id, BULK_ACTIONS[action].format(amount=amount)))
+
+    summary = f"✅ Обработано строк: {report.ok + report.failed}. Успешно: {report.ok}, с ошибками: {report.failed}."
+    await update.message.reply_document(document=report.to_bytes(), filename="report.csv", caption=summary)
+    await admin_command(update, context)
+
+
+async def notification_job(context: ContextTypes.DEFAULT_TYPE):
+    """Отправляет уведомления из очереди не быстрее NOTIFY_PER_SECOND в секунду."""
+    notify_queue = context.bot_data.get("notify_queue")
+    if not notify_queue:
+        return
+    for _ in range(min(len(notify_queue), NOTIFY_PER_SECOND)):
+        target_id, text = notify_queue.popleft()
+        try:
+            await context.bot.send_message(target_id, text)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить уведомление {target_id}: {e}")
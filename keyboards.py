@@ -64,6 +64,7 @@ def get_report_keyboard():
 def get_admin_keyboard():
     keyboard = [
         [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton("📈 Аналитика", callback_data="admin_analytics")],
         [InlineKeyboardButton("💰 Выдать валюту", callback_data="admin_add_currency")],
         [InlineKeyboardButton("💸 Забрать валюту", callback_data="admin_remove_currency")],
         [InlineKeyboardButton("🚫 Завершить все чаты", callback_data="admin_stop_all")],
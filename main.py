@@ -1,13 +1,18 @@
 import asyncio
 import logging
+import signal
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler,
     CallbackQueryHandler, filters
 )
 
+import analytics
 import database as db
 import handlers
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, ANALYTICS_FLUSH_SECONDS, ANALYTICS_ROLLUP_SECONDS, FLOOD_STATE_TTL_SECONDS,
+    REMATCH_INTERVAL_SECONDS
+)
 
 # Настраиваем логирование, чтобы видеть все сообщения в консоли Railway
 logging.basicConfig(
@@ -31,6 +36,17 @@ async def main():
     app.add_handler(CallbackQueryHandler(handlers.handle_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.message_handler))
     app.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO, handlers.media_handler))
+    app.add_handler(MessageHandler(filters.Document.ALL, handlers.document_handler))
+
+    # Повторный подбор для тех, кто ждёт (в т.ч. недавних собеседников после паузы)
+    app.job_queue.run_repeating(handlers.rematch_job, interval=REMATCH_INTERVAL_SECONDS, first=REMATCH_INTERVAL_SECONDS)
+    # Фоновые задачи аналитики: сброс буфера событий и пересчёт дневных агрегатов
+    app.job_queue.run_repeating(analytics.flush_job, interval=ANALYTICS_FLUSH_SECONDS, first=ANALYTICS_FLUSH_SECONDS)
+    app.job_queue.run_repeating(analytics.rollup_job, interval=ANALYTICS_ROLLUP_SECONDS, first=60)
+    # Очистка состояния антифлуда для неактивных пользователей
+    app.job_queue.run_repeating(handlers.flood_sweep_job, interval=FLOOD_STATE_TTL_SECONDS, first=FLOOD_STATE_TTL_SECONDS)
+    # Рассылка уведомлений после массовых админ-операций (с ограничением скорости)
+    app.job_queue.run_repeating(handlers.notification_job, interval=1, first=1)
 
     # Отключаем эту строку, так как будем управлять остановкой по-другому
     # app.post_shutdown(db.close_db)
@@ -44,14 +60,24 @@ async def main():
     await app.updater.start_polling()
 
     # 4. Бот будет работать до тех пор, пока процесс не будет остановлен
-    # (например, командой на Railway или Ctrl+C в консоли)
-    await asyncio.Event().wait()
-
-    # При остановке процесса (например, при перезапуске на Railway)
-    # выполняем корректное завершение работы.
-    await app.updater.stop()
-    await app.stop()
-    await db.close_db()
+    # (например, командой на Railway (SIGTERM) или Ctrl+C в консоли)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows: остаётся стандартная обработка Ctrl+C
+    try:
+        await stop_event.wait()
+    finally:
+        # При остановке процесса (например, при перезапуске на Railway)
+        # выполняем корректное завершение работы и сохраняем буфер аналитики.
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+        await analytics.flush()
+        await db.close_db()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+from collections import OrderedDict, deque
+
+# Веса для оценки кандидата: одно общее увлечение "стоит" INTEREST_WEIGHT очков,
+# каждая секунда ожидания — WAIT_WEIGHT очков (но не больше WAIT_CAP_SECONDS).
+INTEREST_WEIGHT = 10.0
+WAIT_WEIGHT = 0.5
+WAIT_CAP_SECONDS = 120
+
+
+class RecentPartners:
+    """Хранит для каждого пользователя кольцо из последних собеседников.
+
+    Кольцо — это deque фиксированной длины, поэтому на пользователя уходит
+    не больше `size` ID. Сами пользователи вытесняются по LRU, когда их
+    больше `max_users`, чтобы структура не росла бесконечно.
+    """
+
+    def __init__(self, size: int, max_users: int = 50_000):
+        self.size = size
+        self.max_users = max_users
+        self._rings = OrderedDict()
+
+    def remember(self, user1_id: int, user2_id: int):
+        for uid, partner in ((user1_id, user2_id), (user2_id, user1_id)):
+            ring = self._rings.get(uid)
+            if ring is None:
+                ring = self._rings[uid] = deque(maxlen=self.size)
+            else:
+                self._rings.move_to_end(uid)
+            if partner in ring:
+                ring.remove(partner)
+            ring.append(partner)
+        while len(self._rings) > self.max_users:
+            self._rings.popitem(last=False)
+
+    def is_recent(self, user1_id: int, user2_id: int) -> bool:
+        ring1 = self._rings.get(user1_id)
+        ring2 = self._rings.get(user2_id)
+        return bool((ring1 and user2_id in ring1) or (ring2 and user1_id in ring2))
+
+    def __len__(self):
+        return len(self._rings)
+
+
+def score_candidate(interests, candidate_interests, waited_seconds) -> float:
+    """Оценка кандидата: пересечение интересов плюс бонус за время ожидания."""
+    overlap = len(set(interests or []) & set(candidate_interests or []))
+    waited = min(max(waited_seconds or 0, 0), WAIT_CAP_SECONDS)
+    return overlap * INTEREST_WEIGHT + waited * WAIT_WEIGHT
+
+
+def pick_partner(user_id: int, interests, candidates, recent: RecentPartners, grace_seconds: float):
+    """Выбирает лучшего собеседника из ограниченного списка кандидатов.
+
+    `candidates` — последовательность (user_id, interests, waited_seconds),
+    обычно результат `db.find_partner_candidates`. Недавние собеседники
+    пропускаются, пока кандидат ждёт меньше `grace_seconds`; после этого
+    их соединяет фоновый повторный подбор (handlers.rematch_job).
+    Время работы линейно по размеру списка кандидатов.
+    """
+    best_id, best_score = None, None
+    for candidate_id, candidate_interests, waited in candidates:
+        if candidate_id == user_id:
+            continue
+        if recent.is_recent(user_id, candidate_id) and (waited or 0) < grace_seconds:
+            continue
+        score = score_candidate(interests, candidate_interests, waited)
+        if best_score is None or score > best_score:
+            best_id, best_score = candidate_id, score
+    return best_id
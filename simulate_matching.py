@@ -0,0 +1,136 @@
+"""Симулятор подбора собеседников.
+
+Прогоняет одну и ту же нагрузку через старую политику (любой подходящий
+ожидающий, как было с `LIMIT 1`) и через matching.pick_partner, после чего
+печатает распределение времени ожидания и долю пар, где собеседник ещё был
+в кольце недавних (RecentPartners). Как и в боте, ожидающим периодически
+повторно подбирают пару (handlers.rematch_job).
+
+Запуск: python simulate_matching.py --users 300 --duration 3600
+"""
+import argparse
+import random
+import statistics
+
+import matching
+
+INTERESTS = ["Музыка", "Игры", "Кино", "Путешествия", "Общение", "18+"]
+
+def make_legacy_pick(seed):
+    """Старое поведение: произвольный кандидат с общим интересом (LIMIT 1 без ORDER BY)."""
+    rng = random.Random(seed)
+
+    def pick(user_id, interests, candidates, recent, grace_seconds):
+        candidates = [c for c in candidates if c[0] != user_id]
+        return rng.choice(candidates)[0] if candidates else None
+
+    return pick
+
+
+def simulate(pick, users, duration, seed, candidates_limit, recent_limit, grace_seconds,
+             rematch_interval, rematch_batch):
+    rng = random.Random(seed)
+    recent = matching.RecentPartners(recent_limit)
+    next_search_at = {uid: rng.uniform(0, 60) for uid in range(users)}
+    chat_ends_at = {}
+    waiting = {}  # user_id -> (interests, waiting_since); порядок вставки = порядок ожидания
+    waits = []
+    matches = repeats = 0
+
+    def candidates_for(uid, interests, now):
+        candidates = []
+        for cid, (c_interests, since) in waiting.items():
+            if cid != uid and set(interests) & set(c_interests):
+                candidates.append((cid, c_interests, now - since))
+                if len(candidates) >= candidates_limit:
+                    break
+        return candidates
+
+    def connect(uid, partner, now):
+        nonlocal matches, repeats
+        for member in (uid, partner):
+            if member in waiting:
+                waits.append(now - waiting.pop(member)[1])
+            else:
+                waits.append(0)
+        matches += 1
+        if recent.is_recent(uid, partner):
+            repeats += 1
+        recent.remember(uid, partner)
+        chat_ends_at[uid] = chat_ends_at[partner] = now + rng.expovariate(1 / 90)
+
+    for now in range(duration):
+        for uid, end in list(chat_ends_at.items()):
+            if end <= now:
+                del chat_ends_at[uid]
+                next_search_at[uid] = now + rng.expovariate(1 / 30)
+
+        for uid, at in list(next_search_at.items()):
+            if at > now:
+                continue
+            del next_search_at[uid]
+            interests = rng.sample(INTERESTS, rng.randint(1, 3))
+            partner = pick(uid, interests, candidates_for(uid, interests, now), recent, grace_seconds)
+            if partner is None:
+                waiting[uid] = (interests, now)
+            else:
+                connect(uid, partner, now)
+
+        if rematch_interval and now % rematch_interval == 0:
+            for uid in list(waiting)[:rematch_batch]:
+                if uid not in waiting:
+                    continue
+                interests = waiting[uid][0]
+                partner = pick(uid, interests, candidates_for(uid, interests, now), recent, grace_seconds)
+                if partner is not None:
+                    connect(uid, partner, now)
+
+    still_waiting = [duration - since for _, since in waiting.values()]
+    return waits, still_waiting, matches, repeats
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(name, waits, still_waiting, matches, repeats):
+    all_waits = waits + still_waiting
+    print(f"--- {name} ---")
+    print(f"  Чатов создано: {matches}, с недавним собеседником: {repeats} ({repeats / max(matches, 1):.1%})")
+    print(
+        f"  Ожидание, с: среднее {statistics.fmean(all_waits) if all_waits else 0:.1f}, "
+        f"p50 {_percentile(all_waits, 50):.0f}, p90 {_percentile(all_waits, 90):.0f}, "
+        f"p99 {_percentile(all_waits, 99):.0f}, max {max(all_waits, default=0):.0f}"
+    )
+    print(f"  Всё ещё в поиске к концу: {len(still_waiting)}, дольше всех ждёт: {max(still_waiting, default=0):.0f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duration", type=int, default=3600, help="длительность симуляции в секундах")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--recent", type=int, default=5)
+    parser.add_argument("--grace", type=float, default=30)
+    parser.add_argument("--rematch-interval", type=int, default=10, help="0 — без повторного подбора")
+    parser.add_argument("--rematch-batch", type=int, default=20)
+    args = parser.parse_args()
+
+    policies = (
+        ("LIMIT 1 (старая политика)", make_legacy_pick(args.seed)),
+        ("matching.pick_partner", matching.pick_partner),
+    )
+    for name, pick in policies:
+        result = simulate(
+            pick, args.users, args.duration, args.seed, args.candidates, args.recent, args.grace,
+            args.rematch_interval, args.rematch_batch
+        )
+        report(name, *result)
+
+
+if __name__ == "__main__":
+    main()